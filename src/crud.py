@@ -1,12 +1,39 @@
+import os
+from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, Query, HTTPException, status
+from fastapi.responses import Response, StreamingResponse
+from cachetools import TTLCache
+import orjson
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, delete, bindparam, tuple_, String
+from sqlalchemy.schema import CreateIndex, DropIndex
 from .schemas import Note, CreateNote, UpdateNote
-from .database import get_db 
+from .database import get_db, get_write_db
 from .models import Note as NoteModel
-from datetime import datetime
 
 
+# Запросы по id собираются один раз; значение id передаётся параметром при выполнении
+_SELECT_NOTE_BY_ID = select(NoteModel).where(NoteModel.id == bindparam("note_id"))
+_UPDATE_NOTE_BY_ID = update(NoteModel).where(NoteModel.id == bindparam("note_id")).returning(NoteModel)
+_DELETE_NOTE_BY_ID = delete(NoteModel).where(NoteModel.id == bindparam("note_id"))
+
+# Кэш GET /notes/{id} в памяти процесса; сбрасывается при PUT/DELETE.
+# Сброс видит только процесс, обработавший запись, поэтому при нескольких воркерах (WEB_CONCURRENCY > 1) кэш отключён
+NOTE_CACHE_ENABLED = int(os.getenv("WEB_CONCURRENCY", 1)) <= 1
+_note_cache: TTLCache[int, dict] = TTLCache(maxsize=1024, ttl=5)
+# Счётчик инвалидаций: чтение, во время которого заметку изменили или удалили, не должно класть в кэш устаревшие данные
+_note_cache_generation = 0
+
+def _invalidate_cached_note(note_id: int):
+    global _note_cache_generation
+    _note_cache.pop(note_id, None)
+    _note_cache_generation += 1
+
+# При массовой вставке больше этого числа заметок вторичные индексы удаляются и строятся заново после вставки.
+# Перестройка проходит по всей таблице и держит блокировку на запись, поэтому выгодна только при загрузке
+# в пустую или небольшую таблицу; новые строки и так попадают в конец ix_notes_created_id. По умолчанию 0 - отключено
+BULK_INDEX_REBUILD_THRESHOLD = int(os.getenv("NOTES_BULK_INDEX_REBUILD_THRESHOLD", 0))
+
 router = APIRouter(
     prefix="/notes",
     tags=["notes"]
@@ -15,72 +42,124 @@ router = APIRouter(
 @router.post("/", response_model=Note, status_code=status.HTTP_201_CREATED) 
 async def create_note(
     note: CreateNote, 
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_write_db)
 ): 
     db_note = NoteModel(
         title=note.title,
-        content=note.content,
-        created_at=datetime.now(),
-        updated_at=datetime.now()
+        content=note.content
     )
     db.add(db_note)
     await db.commit() 
-    await db.refresh(db_note)
     return db_note
 
-@router.get("/", response_model=list[Note])
+@router.post("/bulk", response_model=list[Note], status_code=status.HTTP_201_CREATED)
+async def create_notes_bulk(
+    notes: list[CreateNote],
+    db: AsyncSession = Depends(get_write_db)
+):
+    if not notes:
+        return []
+    values = [{"title": note.title, "content": note.content} for note in notes]
+    rebuild_indexes = 0 < BULK_INDEX_REBUILD_THRESHOLD < len(notes)
+    if rebuild_indexes:
+        for index in NoteModel.__table__.indexes:
+            await db.execute(DropIndex(index, if_exists=True))
+    result = await db.execute(insert(NoteModel).returning(NoteModel, sort_by_parameter_order=True), values)
+    created_notes = result.scalars().all()
+    if rebuild_indexes:
+        # DDL в SQLite транзакционный: индексы пересоздаются в той же транзакции, что и вставка
+        for index in NoteModel.__table__.indexes:
+            await db.execute(CreateIndex(index, if_not_exists=True))
+    await db.commit()
+    return created_notes
+
+async def _stream_notes(result):
+    # Строки кодируются и отправляются клиенту по мере чтения из курсора, без сборки всего списка в памяти
+    try:
+        separator = b""
+        yield b"["
+        async for row in result.mappings():
+            yield separator + orjson.dumps(dict(row))
+            separator = b","
+        yield b"]"
+    finally:
+        await result.close()
+
+def _to_stored_timestamp(value: datetime) -> str:
+    # created_at заполняет CURRENT_TIMESTAMP (UTC, строка "YYYY-MM-DD HH:MM:SS"); курсор сравнивается
+    # как строка в том же формате, иначе "...:36" и "...:36.000000" не совпадут
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(sep=" ")
+
+@router.get("/", responses={200: {"model": list[Note]}})
 async def get_notes(
     skip: int = Query(0, ge=0), 
     limit: int = Query(100, ge=1, le=100), 
+    after_created_at: datetime | None = Query(None, description="Курсор: created_at последней заметки предыдущей страницы (передаётся вместе с after_id)"),
+    after_id: int | None = Query(None, ge=1, description="Курсор: id последней заметки предыдущей страницы; следующая страница продолжает тот же порядок (предпочтительнее, чем skip)"),
     db: AsyncSession = Depends(get_db)
 ):
-    stmt = select(NoteModel).offset(skip).limit(limit)
-    result = await db.execute(stmt)
-    notes = result.scalars().all()
-    return notes
+    if (after_created_at is None) != (after_id is None):
+        raise HTTPException(status_code=422, detail="after_created_at and after_id must be provided together")
+    stmt = select(
+        NoteModel.id,
+        NoteModel.title,
+        NoteModel.content,
+        NoteModel.created_at,
+        NoteModel.updated_at
+    ).order_by(NoteModel.created_at.desc(), NoteModel.id.desc())
+    if after_id is not None:
+        # Keyset-пагинация по (created_at, id) - тем же ключам и индексу, что и порядок списка.
+        # Курсор целиком приходит от клиента, поэтому заметка-курсор может быть уже удалена
+        cursor_created_at = bindparam("after_created_at", _to_stored_timestamp(after_created_at), type_=String)
+        stmt = stmt.where(tuple_(NoteModel.created_at, NoteModel.id) < tuple_(cursor_created_at, after_id))
+    stmt = stmt.offset(skip).limit(limit)
+    # Запрос выполняется до отправки заголовков, чтобы ошибки БД приводили к 500, а не к обрезанному ответу 200
+    result = await db.stream(stmt)
+    return StreamingResponse(_stream_notes(result), media_type="application/json")
 
 @router.get("/{note_id}", response_model=Note)
 async def get_note_by_id(note_id: int, db: AsyncSession = Depends(get_db)):
-    stmt = select(NoteModel).where(NoteModel.id == note_id)
-    result = await db.execute(stmt)
+    cached_note = _note_cache.get(note_id) if NOTE_CACHE_ENABLED else None
+    if cached_note is not None:
+        return cached_note
+    generation = _note_cache_generation
+    result = await db.execute(_SELECT_NOTE_BY_ID, {"note_id": note_id})
     note = result.scalar_one_or_none()
     if not note:
         raise HTTPException(status_code=404, detail=f"Note with id {note_id} not found")
-    return note
+    note_data = Note.model_validate(note).model_dump()
+    if NOTE_CACHE_ENABLED and generation == _note_cache_generation:
+        _note_cache[note_id] = note_data
+    return note_data
 
 @router.put("/{note_id}", response_model=Note)
 async def update_note(
     note_id: int,
     note_update: UpdateNote,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_write_db)
 ):
-    stmt = select(NoteModel).where(NoteModel.id == note_id)
-    result = await db.execute(stmt)
+    stmt = _UPDATE_NOTE_BY_ID.values(**note_update.model_dump(exclude_none=True))
+    result = await db.execute(stmt, {"note_id": note_id})
     note = result.scalar_one_or_none()
 
     if not note:
         raise HTTPException(status_code=404, detail=f"Note with id {note_id} not found")
-    
-    if note_update.title is not None:
-        note.title = note_update.title
-    if note_update.content is not None:
-        note.content = note_update.content
-    
-    note.updated_at = datetime.now()
+
     await db.commit()
-    await db.refresh(note) 
+    _invalidate_cached_note(note_id)
 
     return note
 
-@router.delete("/{note_id}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/{note_id}", status_code=status.HTTP_204_NO_CONTENT, response_class=Response)
 async def delete_note(
     note_id: int,
-    db: AsyncSession = Depends(get_db) 
+    db: AsyncSession = Depends(get_write_db) 
 ):
-    stmt_check = select(NoteModel).where(NoteModel.id == note_id)
-    result_check = await db.execute(stmt_check)
-    note_to_delete = result_check.scalar_one_or_none()
-    if not note_to_delete:
+    result = await db.execute(_DELETE_NOTE_BY_ID, {"note_id": note_id})
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail=f"Note with id {note_id} not found")
-    await db.delete(note_to_delete) 
     await db.commit()
+    _invalidate_cached_note(note_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -1,4 +1,7 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy import event
+from sqlalchemy.schema import CreateTable, CreateIndex
+import asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, async_scoped_session, AsyncSession
 from sqlalchemy.orm import declarative_base
 
 SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./mydatabase.db"
@@ -6,19 +9,102 @@ SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./mydatabase.db"
 
 engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
+    pool_size=20,
+    max_overflow=10,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    pool_recycle=3600,
     # echo=True # раскомментируйте, чтобы видеть SQL-запросы в консоли
 )
 
+# Отдельный движок для записи с единственным соединением: пишущие запросы ждут своей очереди в пуле,
+# а не конкурируют за блокировку SQLite и не получают SQLITE_BUSY
+write_engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=1,
+    max_overflow=0,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    pool_recycle=3600,
+)
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL позволяет читать параллельно с записью, synchronous=NORMAL уменьшает число fsync
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+for _engine in (engine, write_engine):
+    event.listen(_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+
+@event.listens_for(write_engine.sync_engine, "connect")
+def disable_driver_begin(dbapi_connection, connection_record):
+    # Транзакции на соединении для записи открывает SQLAlchemy (см. begin_immediate), а не драйвер
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(write_engine.sync_engine, "begin")
+def begin_immediate(conn):
+    # Блокировка на запись берётся сразу при открытии транзакции, а не при первом INSERT/UPDATE
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
 async_session_local = async_sessionmaker(
     autocommit=False,
     autoflush=False,
+    expire_on_commit=False,
     bind=engine,
     class_=AsyncSession 
 )
 
+async_write_session_local = async_sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=write_engine,
+    class_=AsyncSession 
+)
+
+# Одна сессия на asyncio-задачу (запрос), удаляется из реестра по завершении запроса
+AsyncScopedSession = async_scoped_session(async_session_local, scopefunc=asyncio.current_task)
+AsyncScopedWriteSession = async_scoped_session(async_write_session_local, scopefunc=asyncio.current_task)
+
 Base = declarative_base()
 
 async def get_db():
-    async with async_session_local() as session:
+    session = AsyncScopedSession()
+    try:
+        yield session
+    finally:
+        await AsyncScopedSession.remove()
+
+async def get_write_db():
+    session = AsyncScopedWriteSession()
+    try:
         yield session
-       
\ No newline at end of file
+    finally:
+        await AsyncScopedWriteSession.remove()
+
+def build_schema_script(metadata) -> str:
+    statements = []
+    for table in metadata.sorted_tables:
+        statements.append(CreateTable(table, if_not_exists=True))
+        statements.extend(CreateIndex(index, if_not_exists=True) for index in table.indexes)
+    ddl = "".join(f"{str(stmt.compile(dialect=engine.dialect)).strip()};\n" for stmt in statements)
+    return f"BEGIN;\n{ddl}COMMIT;"
+
+async def init_db():
+    # Вся схема создаётся одним скриптом в одной транзакции вместо отдельного запроса на каждую таблицу/индекс
+    async with write_engine.connect() as conn:
+        raw_connection = await conn.get_raw_connection()
+        await raw_connection.driver_connection.executescript(build_schema_script(Base.metadata))
@@ -1,22 +1,41 @@
+import os
+import sys
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
-from .models import Base
-from .database import engine 
+from . import models
+from .database import init_db
 from .crud import router
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Запускается инициализация приложения...")
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    await init_db()
     print("Инициализация завершена. Приложение запущено.")
     yield 
     print("Приложение остановлено. Выполняется очистка...")
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(router)
 
 @app.get('/')
 async def root():
     return {"status": "Server work"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+    # Воркеры наследуют окружение: по WEB_CONCURRENCY crud отключает кэш, который не разделяется между процессами
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+    uvicorn.run(
+        "src.main:app",
+        host="127.0.0.1",
+        port=8000,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # uvloop не поддерживает Windows
+        http="httptools",
+        workers=workers
+    )
@@ -1,10 +1,16 @@
-from sqlalchemy import Column, Integer, String, DateTime 
+from sqlalchemy import Column, Integer, String, DateTime, Index 
+from sqlalchemy.sql import func
 from .database import Base
 
 class Note(Base):
     __tablename__ = "notes"
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True, nullable=False)
+    __mapper_args__ = {"eager_defaults": True}
+    id = Column(Integer, primary_key=True)
+    title = Column(String, nullable=False)
     content = Column(String, nullable=True)
-    created_at = Column(DateTime, index=True, nullable=False) 
-    updated_at = Column(DateTime, index=True, nullable=False) 
\ No newline at end of file
+    created_at = Column(DateTime, nullable=False, server_default=func.now()) 
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_notes_created_id", created_at.desc(), id.desc()),
+    )
\ No newline at end of file
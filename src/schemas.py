@@ -1,4 +1,4 @@
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, ConfigDict, model_validator
 from datetime import datetime
 from typing import Optional
 
@@ -10,13 +10,16 @@ class UpdateNote(BaseModel):
     title: Optional[str] = None
     content: Optional[str] = None
 
-    @model_validator(mode='after')
-    def validate_at_least_one_field(self):
-        if self.title is None and self.content is None:
+    @model_validator(mode='before')
+    @classmethod
+    def validate_at_least_one_field(cls, data):
+        if isinstance(data, dict) and data.get("title") is None and data.get("content") is None:
             raise ValueError('At least one of "title" or "content" must be provided and not None.')
-        return self 
+        return data 
 
 class Note(CreateNote):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     created_at: datetime
     updated_at: datetime
@@ -1,38 +1,29 @@
-import asyncio
 from datetime import datetime
-from fastapi.testclient import TestClient
+from httpx import ASGITransport, AsyncClient
 from src.main import app 
+from src import crud
+from src.database import engine, write_engine, async_session_local, get_db
+from sqlalchemy import event
 from src.schemas import Note as NoteSchema
 import pytest
+import pytest_asyncio
 from pydantic import ValidationError
-from src.database import engine
-from src.models import Base
 
-@pytest.fixture(scope="module", autouse=True)
-def setup_test_db():
-    print("Запускается инициализация тестовой базы данных...")
-    async def run_startup():
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
+pytestmark = pytest.mark.asyncio(loop_scope="module")
 
-    asyncio.run(run_startup())
-    print("Тестовая база данных инициализирована.")
+@pytest_asyncio.fixture(scope="module", loop_scope="module")
+async def client():
+    # Один event loop и один lifespan на весь модуль: движок и пул соединений общие для всех тестов
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as c:
+            yield c
 
-    yield 
-
-    print("Тестовая база данных очищена (если была добавлена логика).")
-
-@pytest.fixture(scope="module")
-def client(setup_test_db): 
-    with TestClient(app) as c:
-        yield c
-
-def test_root(client: TestClient):
-    response = client.get("/")
+async def test_root(client: AsyncClient):
+    response = await client.get("/")
     assert response.status_code == 200
     assert response.json() == {"status": "Server work"}
 
-def test_create_note(client: TestClient):
+async def test_create_note(client: AsyncClient):
     """
     Тестирует маршрут POST /notes/ для создания новой заметки.
     """
@@ -41,7 +32,7 @@ def test_create_note(client: TestClient):
         "content": "Это содержание тестовой заметки."
     }
 
-    response = client.post("/notes/", json=new_note_data) 
+    response = await client.post("/notes/", json=new_note_data) 
 
     assert response.status_code == 201 
 
@@ -67,7 +58,7 @@ def test_create_note(client: TestClient):
     except ValidationError as e:
         pytest.fail(f"Ответ не соответствует схеме NoteSchema: {e}")
 
-def test_create_note_invalid_data(client: TestClient):
+async def test_create_note_invalid_data(client: AsyncClient):
     """
     Тестирует маршрут POST /notes/ с неверными данными (например, без обязательного поля title).
     Ожидается HTTP 422 Unprocessable Entity.
@@ -77,12 +68,89 @@ def test_create_note_invalid_data(client: TestClient):
         "content": "Это содержание без заголовка." 
     }
 
-    response = client.post("/notes/", json=invalid_note_data)
+    response = await client.post("/notes/", json=invalid_note_data)
 
     assert response.status_code == 422 
 
 
-def test_get_notes(client: TestClient):
+async def test_create_notes_bulk(client: AsyncClient):
+    """
+    Тестирует маршрут POST /notes/bulk для создания нескольких заметок одним запросом.
+    """
+    notes_data = [
+        {"title": "Bulk Note 1", "content": "Content of bulk note 1"},
+        {"title": "Bulk Note 2"}
+    ]
+
+    response = await client.post("/notes/bulk", json=notes_data)
+
+    assert response.status_code == 201
+
+    response_data = response.json()
+    assert isinstance(response_data, list)
+    assert len(response_data) == len(notes_data)
+
+    for note, expected in zip(response_data, notes_data):
+        try:
+            NoteSchema.model_validate(note)
+        except ValidationError as e:
+            pytest.fail(f"Элемент списка заметок не соответствует схеме NoteSchema: {e}")
+        assert note["title"] == expected["title"]
+        assert note["content"] == expected.get("content")
+
+    get_response = await client.get(f"/notes/{response_data[0]['id']}")
+    assert get_response.status_code == 200
+    assert get_response.json()["title"] == notes_data[0]["title"]
+
+
+async def post_bulk_recording_ddl(client: AsyncClient, notes_data):
+    executed_statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        executed_statements.append(statement.strip())
+
+    event.listen(write_engine.sync_engine, "before_cursor_execute", record_statement)
+    try:
+        response = await client.post("/notes/bulk", json=notes_data)
+    finally:
+        event.remove(write_engine.sync_engine, "before_cursor_execute", record_statement)
+    return response, executed_statements
+
+
+async def test_create_notes_bulk_rebuilds_indexes(client: AsyncClient, monkeypatch):
+    """
+    Тестирует POST /notes/bulk для пачки больше порога: индексы удаляются перед вставкой
+    и пересоздаются после неё.
+    """
+    monkeypatch.setattr(crud, "BULK_INDEX_REBUILD_THRESHOLD", 1)
+    notes_data = [{"title": f"Large Bulk Note {i}"} for i in range(3)]
+
+    response, executed_statements = await post_bulk_recording_ddl(client, notes_data)
+
+    assert response.status_code == 201
+    assert len(response.json()) == len(notes_data)
+    assert any(stmt.startswith("DROP INDEX") and "ix_notes_created_id" in stmt for stmt in executed_statements)
+    assert any(stmt.startswith("CREATE INDEX") and "ix_notes_created_id" in stmt for stmt in executed_statements)
+
+    async with engine.connect() as conn:
+        result = await conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")
+        index_names = set(result.scalars().all())
+    assert "ix_notes_created_id" in index_names
+
+
+async def test_create_notes_bulk_keeps_indexes_by_default(client: AsyncClient):
+    """
+    Тестирует POST /notes/bulk с настройками по умолчанию: перестройка индексов отключена.
+    """
+    notes_data = [{"title": f"Default Bulk Note {i}"} for i in range(3)]
+
+    response, executed_statements = await post_bulk_recording_ddl(client, notes_data)
+
+    assert response.status_code == 201
+    assert not any(stmt.startswith(("DROP INDEX", "CREATE INDEX")) for stmt in executed_statements)
+
+
+async def test_get_notes(client: AsyncClient):
     """
     Тестирует маршрут GET /notes/ для получения заметок с пагинацией
     """
@@ -90,12 +158,12 @@ def test_get_notes(client: TestClient):
     note2_data = {"title": "Test Note 2", "content": "Content of note 2"}
     note3_data = {"title": "Test Note 3", "content": "Content of note 3"}
 
-    client.post("/notes/", json=note1_data)
-    client.post("/notes/", json=note2_data)
-    client.post("/notes/", json=note3_data)
+    await client.post("/notes/", json=note1_data)
+    await client.post("/notes/", json=note2_data)
+    await client.post("/notes/", json=note3_data)
 
     # --- Тест 1: Значения skip и limit по умолчанию ---
-    response = client.get("/notes/")
+    response = await client.get("/notes/")
     assert response.status_code == 200
 
     response_data = response.json()
@@ -114,8 +182,8 @@ def test_get_notes(client: TestClient):
     assert note3_data["title"] in titles_in_response
 
     # --- Тест 2: Пагинация с параметрами ---
-    # GET /notes/?skip=1&limit=1 -> должна вернуть только вторую созданную заметку
-    response_paginated = client.get("/notes/?skip=1&limit=1")
+    # GET /notes/?skip=1&limit=1 -> должна вернуть только вторую по новизне заметку
+    response_paginated = await client.get("/notes/?skip=1&limit=1")
     assert response_paginated.status_code == 200
 
     paginated_data = response_paginated.json()
@@ -127,7 +195,85 @@ def test_get_notes(client: TestClient):
         pytest.fail(f"Элемент списка пагинированных заметок не соответствует схеме NoteSchema: {e}")
 
 
-def test_get_note_by_id_success(client: TestClient):
+async def test_get_notes_keyset_pagination(client: AsyncClient):
+    """
+    Тестирует маршрут GET /notes/ с курсором after_created_at + after_id (keyset-пагинация):
+    страница по курсору продолжает первую страницу списка по умолчанию без пропусков и повторов.
+    """
+    notes_data = [{"title": f"Keyset Note {i}"} for i in range(4)]
+    create_response = await client.post("/notes/bulk", json=notes_data)
+    assert create_response.status_code == 201
+    created_ids = [note["id"] for note in create_response.json()]
+
+    # Первая страница - список по умолчанию (сначала новые)
+    response = await client.get("/notes/?limit=2")
+    assert response.status_code == 200
+
+    page = response.json()
+    assert [note["id"] for note in page] == created_ids[::-1][:2]
+
+    # Следующая страница: курсор - id последней заметки текущей страницы
+    next_response = await client.get(
+        "/notes/",
+        params={"after_created_at": page[-1]["created_at"], "after_id": page[-1]["id"], "limit": 2}
+    )
+    assert next_response.status_code == 200
+
+    next_page = next_response.json()
+    assert [note["id"] for note in next_page] == created_ids[::-1][2:]
+
+    full_response = await client.get("/notes/?limit=4")
+    assert [note["id"] for note in page + next_page] == [note["id"] for note in full_response.json()]
+
+
+async def test_get_notes_keyset_pagination_cursor_deleted(client: AsyncClient):
+    """
+    Тестирует маршрут GET /notes/ с курсором, указывающим на удалённую заметку:
+    следующая страница должна вернуться как обычно.
+    """
+    notes_data = [{"title": f"Deleted Cursor Note {i}"} for i in range(3)]
+    create_response = await client.post("/notes/bulk", json=notes_data)
+    assert create_response.status_code == 201
+    created_notes = create_response.json()
+    created_ids = [note["id"] for note in created_notes]
+
+    # Курсор - последняя заметка страницы [id3, id2], после чего её удаляют
+    cursor_note = created_notes[1]
+    delete_response = await client.delete(f"/notes/{cursor_note['id']}")
+    assert delete_response.status_code == 204
+
+    response = await client.get(
+        "/notes/",
+        params={"after_created_at": cursor_note["created_at"], "after_id": cursor_note["id"], "limit": 1}
+    )
+    assert response.status_code == 200
+    assert [note["id"] for note in response.json()] == [created_ids[0]]
+
+
+async def test_get_notes_database_error(client: AsyncClient):
+    """
+    Тестирует маршрут GET /notes/ при ошибке БД: ошибка должна превращаться в HTTP 500
+    до начала отправки тела ответа, а не в обрезанный ответ 200.
+    """
+    class FailingSession:
+        async def stream(self, *args, **kwargs):
+            raise RuntimeError("database is unavailable")
+
+    async def get_failing_db():
+        yield FailingSession()
+
+    app.dependency_overrides[get_db] = get_failing_db
+    try:
+        transport = ASGITransport(app=app, raise_app_exceptions=False)
+        async with AsyncClient(transport=transport, base_url="http://test") as failing_client:
+            response = await failing_client.get("/notes/")
+    finally:
+        app.dependency_overrides.pop(get_db)
+
+    assert response.status_code == 500
+
+
+async def test_get_note_by_id_success(client: AsyncClient):
     """
     Тестирует маршрут GET /notes/{id} для получения существующей заметки.
     """
@@ -135,14 +281,14 @@ def test_get_note_by_id_success(client: TestClient):
         "title": "Тестовая заметка для получения",
         "content": "Это содержание тестовой заметки для получения."
     }
-    create_response = client.post("/notes/", json=new_note_data)
+    create_response = await client.post("/notes/", json=new_note_data)
     assert create_response.status_code == 201
     created_note = create_response.json()
     note_id = created_note["id"]
     expected_title = created_note["title"]
     expected_content = created_note["content"]
 
-    response = client.get(f"/notes/{note_id}")
+    response = await client.get(f"/notes/{note_id}")
 
     assert response.status_code == 200 
 
@@ -161,7 +307,7 @@ def test_get_note_by_id_success(client: TestClient):
     assert isinstance(response_data["updated_at"], str)
 
 
-def test_get_note_by_id_not_found(client: TestClient):
+async def test_get_note_by_id_not_found(client: AsyncClient):
     """
     Тестирует маршрут GET /notes/{id} для получения несуществующей заметки.
     Ожидается HTTP 404 Not Found.
@@ -169,7 +315,7 @@ def test_get_note_by_id_not_found(client: TestClient):
     # Используем заведомо несуществующий ID (например, 99999)
     non_existent_id = 99999
 
-    response = client.get(f"/notes/{non_existent_id}")
+    response = await client.get(f"/notes/{non_existent_id}")
 
     assert response.status_code == 404 
 
@@ -178,7 +324,7 @@ def test_get_note_by_id_not_found(client: TestClient):
     assert f"Note with id {non_existent_id} not found" in response_data["detail"]
 
 
-def test_update_note_title_success(client: TestClient):
+async def test_update_note_title_success(client: AsyncClient):
     """
     Тестирует маршрут PUT /notes/{id} для обновления только заголовка (title) существующей заметки.
     """
@@ -187,7 +333,7 @@ def test_update_note_title_success(client: TestClient):
         "title": "Старый заголовок",
         "content": "Старое содержание"
     }
-    create_response = client.post("/notes/", json=initial_data)
+    create_response = await client.post("/notes/", json=initial_data)
     assert create_response.status_code == 201
     created_note = create_response.json()
     note_id = created_note["id"]
@@ -198,7 +344,7 @@ def test_update_note_title_success(client: TestClient):
         # content не передаётся, должно остаться старым
     }
 
-    response = client.put(f"/notes/{note_id}", json=update_data)
+    response = await client.put(f"/notes/{note_id}", json=update_data)
 
     assert response.status_code == 200 
 
@@ -219,7 +365,7 @@ def test_update_note_title_success(client: TestClient):
 
     assert updated_at_dt >= initial_created_at_dt 
 
-def test_update_note_content_success(client: TestClient):
+async def test_update_note_content_success(client: AsyncClient):
     """
     Тестирует маршрут PUT /notes/{id} для обновления только содержания (content) существующей заметки.
     """
@@ -227,7 +373,7 @@ def test_update_note_content_success(client: TestClient):
         "title": "Старый заголовок",
         "content": "Старое содержание"
     }
-    create_response = client.post("/notes/", json=initial_data)
+    create_response = await client.post("/notes/", json=initial_data)
     assert create_response.status_code == 201
     created_note = create_response.json()
     note_id = created_note["id"]
@@ -239,7 +385,7 @@ def test_update_note_content_success(client: TestClient):
         # title не передаётся, должен остаться старым
     }
 
-    response = client.put(f"/notes/{note_id}", json=update_data)
+    response = await client.put(f"/notes/{note_id}", json=update_data)
 
     assert response.status_code == 200 
 
@@ -259,7 +405,7 @@ def test_update_note_content_success(client: TestClient):
     updated_at_dt = datetime.fromisoformat(updated_note["updated_at"].replace('Z', '+00:00')) if 'Z' in updated_note["updated_at"] else datetime.fromisoformat(updated_note["updated_at"])
     assert updated_at_dt >= initial_created_at_dt
 
-def test_update_note_title_and_content_success(client: TestClient):
+async def test_update_note_title_and_content_success(client: AsyncClient):
     """
     Тестирует маршрут PUT /notes/{id} для обновления и заголовка, и содержания существующей заметки.
     """
@@ -267,7 +413,7 @@ def test_update_note_title_and_content_success(client: TestClient):
         "title": "Старый заголовок",
         "content": "Старое содержание"
     }
-    create_response = client.post("/notes/", json=initial_data)
+    create_response = await client.post("/notes/", json=initial_data)
     assert create_response.status_code == 201
     created_note = create_response.json()
     note_id = created_note["id"]
@@ -279,7 +425,7 @@ def test_update_note_title_and_content_success(client: TestClient):
         "content": "Новое содержание"
     }
 
-    response = client.put(f"/notes/{note_id}", json=update_data)
+    response = await client.put(f"/notes/{note_id}", json=update_data)
 
     assert response.status_code == 200 
 
@@ -299,7 +445,53 @@ def test_update_note_title_and_content_success(client: TestClient):
     updated_at_dt = datetime.fromisoformat(updated_note["updated_at"].replace('Z', '+00:00')) if 'Z' in updated_note["updated_at"] else datetime.fromisoformat(updated_note["updated_at"])
     assert updated_at_dt >= initial_created_at_dt
 
-def test_update_note_not_found(client: TestClient):
+async def test_get_note_by_id_after_update(client: AsyncClient):
+    """
+    Тестирует, что GET /notes/{id} возвращает актуальные данные после PUT /notes/{id},
+    даже если заметка уже была запрошена (и закэширована) ранее.
+    """
+    create_response = await client.post("/notes/", json={"title": "Заголовок до обновления"})
+    assert create_response.status_code == 201
+    note_id = create_response.json()["id"]
+
+    get_before_response = await client.get(f"/notes/{note_id}")
+    assert get_before_response.status_code == 200
+    assert get_before_response.json()["title"] == "Заголовок до обновления"
+
+    update_response = await client.put(f"/notes/{note_id}", json={"title": "Заголовок после обновления"})
+    assert update_response.status_code == 200
+
+    get_after_response = await client.get(f"/notes/{note_id}")
+    assert get_after_response.status_code == 200
+    assert get_after_response.json()["title"] == "Заголовок после обновления"
+
+
+async def test_get_note_by_id_not_cached_if_updated_during_read(client: AsyncClient):
+    """
+    Тестирует, что GET /notes/{id} не кладёт в кэш заметку, которую изменили,
+    пока чтение ожидало ответа БД.
+    """
+    create_response = await client.post("/notes/", json={"title": "Заметка для гонки"})
+    assert create_response.status_code == 201
+    note_id = create_response.json()["id"]
+
+    class InvalidatingSession:
+        # Имитирует PUT /notes/{id}, завершившийся во время запроса в get_note_by_id
+        def __init__(self, session):
+            self.session = session
+
+        async def execute(self, *args, **kwargs):
+            result = await self.session.execute(*args, **kwargs)
+            crud._invalidate_cached_note(note_id)
+            return result
+
+    async with async_session_local() as session:
+        await crud.get_note_by_id(note_id, db=InvalidatingSession(session))
+
+    assert note_id not in crud._note_cache
+
+
+async def test_update_note_not_found(client: AsyncClient):
     """
     Тестирует маршрут PUT /notes/{id} для обновления несуществующей заметки.
     Ожидается HTTP 404 Not Found.
@@ -309,7 +501,7 @@ def test_update_note_not_found(client: TestClient):
         "title": "Новый заголовок"
     }
 
-    response = client.put(f"/notes/{non_existent_id}", json=update_data)
+    response = await client.put(f"/notes/{non_existent_id}", json=update_data)
 
     assert response.status_code == 404
 
@@ -318,7 +510,7 @@ def test_update_note_not_found(client: TestClient):
     assert f"Note with id {non_existent_id} not found" in response_data["detail"]
 
 
-def test_update_note_invalid_data_both_null(client: TestClient):
+async def test_update_note_invalid_data_both_null(client: AsyncClient):
     """
     Тестирует маршрут PUT /notes/{id} с данными, где и title, и content равны null.
     Это нарушает валидацию в схеме UpdateNote.
@@ -328,7 +520,7 @@ def test_update_note_invalid_data_both_null(client: TestClient):
         "title": "Старый заголовок",
         "content": "Старое содержание"
     }
-    create_response = client.post("/notes/", json=initial_data)
+    create_response = await client.post("/notes/", json=initial_data)
     assert create_response.status_code == 201
     created_note = create_response.json()
     note_id = created_note["id"]
@@ -339,12 +531,12 @@ def test_update_note_invalid_data_both_null(client: TestClient):
     }
 
 
-    response = client.put(f"/notes/{note_id}", json=invalid_update_data)
+    response = await client.put(f"/notes/{note_id}", json=invalid_update_data)
 
     assert response.status_code == 422 
 
 
-def test_delete_note_success(client: TestClient):
+async def test_delete_note_success(client: AsyncClient):
     """
     Тестирует маршрут DELETE /notes/{id} для удаления существующей заметки.
     """
@@ -353,23 +545,24 @@ def test_delete_note_success(client: TestClient):
         "title": "Тестовая заметка для удаления",
         "content": "Это содержание тестовой заметки для удаления."
     }
-    create_response = client.post("/notes/", json=new_note_data)
+    create_response = await client.post("/notes/", json=new_note_data)
     assert create_response.status_code == 201
     created_note = create_response.json()
     note_id = created_note["id"]
 
-    get_before_response = client.get(f"/notes/{note_id}")
+    get_before_response = await client.get(f"/notes/{note_id}")
     assert get_before_response.status_code == 200
     assert get_before_response.json()["id"] == note_id
 
-    response = client.delete(f"/notes/{note_id}")
+    response = await client.delete(f"/notes/{note_id}")
 
     assert response.status_code == 204 #
+    assert response.content == b""
 
-    get_after_response = client.get(f"/notes/{note_id}")
+    get_after_response = await client.get(f"/notes/{note_id}")
     assert get_after_response.status_code == 404 
 
-def test_delete_note_not_found(client: TestClient):
+async def test_delete_note_not_found(client: AsyncClient):
     """
     Тестирует маршрут DELETE /notes/{id} для удаления несуществующей заметки.
     Ожидается HTTP 404 Not Found.
@@ -377,7 +570,7 @@ def test_delete_note_not_found(client: TestClient):
     # Используем заведомо несуществующий ID (например, 99999)
     non_existent_id = 99999
 
-    response = client.delete(f"/notes/{non_existent_id}")
+    response = await client.delete(f"/notes/{non_existent_id}")
 
     assert response.status_code == 404 
 